@@ -0,0 +1,201 @@
+import os
+import shutil
+from collections import OrderedDict
+from itertools import count
+from tempfile import mkdtemp
+from threading import Lock
+
+
+class BlockCache(object):
+    """Cache of fixed size, aligned file blocks keyed by (file_id, index).
+
+    Blocks are kept in memory up to memory_size bytes. Least recently used
+    blocks are spilled to disk_dir when disk_size is set, and dropped from
+    there when the disk budget is exceeded.
+
+    Files are read, written and removed outside the lock. A key is claimed
+    under the lock first, so a spilled block is served from memory until
+    its file is written, and a file being read back is not in the index
+    for others to remove. Each write goes to a new file name, a file is
+    only ever removed by whoever took its key out of the index."""
+
+    def __init__(self, block_size, memory_size, disk_size=0, disk_dir=None):
+        self.block_size = block_size
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.disk_dir = None
+        if disk_size:
+            self.disk_dir = mkdtemp(prefix='putiofs-', dir=disk_dir)
+
+        self.memory = OrderedDict() # {key: data}, oldest first
+        self.memory_used = 0
+        self.spilling = {} # blocks being written to disk {key: data}
+        self.loading = set() # keys being read back from disk
+        self.disk = OrderedDict() # {key: (size, path)}, oldest first
+        self.disk_used = 0 # includes blocks being written
+        self.serial = count() # makes file names unique
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def _new_path(self, key):
+        name = '%d-%d.%d' % (key[0], key[1], next(self.serial))
+        return os.path.join(self.disk_dir, name)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.memory or key in self.spilling or \
+                key in self.disk or key in self.loading
+
+    def get(self, key):
+        '''Returns the cached block or None'''
+        with self.lock:
+            data = self.memory.pop(key, None)
+            if data is not None:
+                self.memory[key] = data
+                self.hits += 1
+                return data
+
+            data = self.spilling.pop(key, None)
+            if data is not None:
+                # back to memory, the file being written is dropped
+                self.disk_used -= len(data)
+                spills = self._put_memory(key, data)
+                self.hits += 1
+            elif key not in self.disk:
+                self.misses += 1
+                return None
+            else:
+                # claim the file, it is read and removed outside the lock
+                size, path = self.disk.pop(key)
+                self.disk_used -= size
+                self.loading.add(key)
+                self.hits += 1
+
+        if data is not None:
+            self._spill(spills)
+            return data
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except EnvironmentError:
+            data = None # removed by someone else, downloaded again
+        self._remove([path])
+
+        spills = []
+        with self.lock:
+            if data is None:
+                self.loading.discard(key)
+                self.hits -= 1
+                self.misses += 1
+                return None
+            # promote back to memory unless discarded or put meanwhile
+            if key in self.loading:
+                self.loading.remove(key)
+                if key not in self.memory:
+                    spills = self._put_memory(key, data)
+        self._spill(spills)
+        return data
+
+    def put(self, key, data):
+        with self.lock:
+            paths = self._discard(key)
+            spills = self._put_memory(key, data)
+        self._remove(paths)
+        self._spill(spills)
+
+    def _put_memory(self, key, data):
+        '''Adds a block to memory, returns [(key, data, path)] to spill'''
+        self.memory[key] = data
+        self.memory_used += len(data)
+        spills = []
+        while self.memory_used > self.memory_size and self.memory:
+            old_key, old_data = self.memory.popitem(last=False)
+            self.memory_used -= len(old_data)
+            if self.disk_dir and len(old_data) <= self.disk_size:
+                self.spilling[old_key] = old_data
+                self.disk_used += len(old_data)
+                spills.append((old_key, old_data, self._new_path(old_key)))
+        return spills
+
+    def _spill(self, spills):
+        '''Writes blocks evicted from memory to disk, drops the oldest files
+           over the disk budget'''
+        for key, data, path in spills:
+            try:
+                with open(path, 'wb') as f:
+                    f.write(data)
+                written = True
+            except EnvironmentError:
+                written = False # the block is dropped, as if not cached
+
+            paths = []
+            with self.lock:
+                if self.spilling.get(key) is not data:
+                    # read back or discarded while being written
+                    if written:
+                        paths.append(path)
+                elif written:
+                    del self.spilling[key]
+                    self.disk[key] = (len(data), path)
+                else:
+                    del self.spilling[key]
+                    self.disk_used -= len(data)
+                while self.disk_used > self.disk_size and self.disk:
+                    old_key, (size, old_path) = self.disk.popitem(last=False)
+                    self.disk_used -= size
+                    paths.append(old_path)
+            self._remove(paths)
+
+    def _remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass # already gone, a failed removal mustn't fail a read
+
+    def _discard(self, key):
+        '''Drops a block, returns paths of files to remove'''
+        data = self.memory.pop(key, None)
+        if data is not None:
+            self.memory_used -= len(data)
+        data = self.spilling.pop(key, None)
+        if data is not None:
+            self.disk_used -= len(data)
+        self.loading.discard(key)
+        if key in self.disk:
+            size, path = self.disk.pop(key)
+            self.disk_used -= size
+            return [path]
+        return []
+
+    def discard_file(self, file_id):
+        '''Drops all blocks of a file'''
+        paths = []
+        with self.lock:
+            keys = [k for k in self.memory if k[0] == file_id]
+            keys += [k for k in self.spilling if k[0] == file_id]
+            keys += [k for k in self.loading if k[0] == file_id]
+            keys += [k for k in self.disk if k[0] == file_id]
+            for key in keys:
+                paths += self._discard(key)
+        self._remove(paths)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(hits=self.hits, misses=self.misses,
+                hit_rate=self.hits / float(lookups) if lookups else 0,
+                memory_used=self.memory_used, disk_used=self.disk_used)
+
+    def close(self):
+        with self.lock:
+            self.memory.clear()
+            self.spilling.clear()
+            self.loading.clear()
+            self.disk.clear()
+            self.memory_used = self.disk_used = 0
+        if self.disk_dir:
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
@@ -0,0 +1,286 @@
+import sys
+import time
+import socket
+from httplib import HTTPException
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from threading import Lock, Timer
+from urllib import urlencode
+from urlparse import urljoin
+
+from httppool import HTTPError
+from scheduler import READ
+from stats import Histogram
+
+API_URL = 'https://api.put.io/v2'
+
+
+class Downloader(object):
+    """Ranged downloads of put.io files over a ConnectionPool.
+
+    When parallel is more than 1, ranges of at least 2 * min_part_size bytes
+    are split into up to parallel parts which are fetched concurrently.
+
+    The storage URL a download redirects to is remembered per file for
+    url_ttl seconds, so later ranges skip the API round trip. It is resolved
+    again when it expires or the storage node answers 403 or 410.
+
+    An attempt is given up after deadline seconds, and failed attempts are
+    retried up to retries times with exponential backoff. When
+    hedge_percentile is set, a second attempt is started once the first
+    takes longer than that percentile of past attempts, and the first
+    answer is used. Time spent waiting for the scheduler of the pool is
+    not counted against either, an attempt is not slow while it is still
+    queued."""
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    expired_codes = (403, 410)
+    max_redirects = 5
+    min_hedge_samples = 20 # attempts measured before hedging starts
+
+    def __init__(self, pool, oauth_token, api_url=API_URL, parallel=1,
+            min_part_size=256 * 1024, url_ttl=600, deadline=0, retries=0,
+            backoff=0.1, hedge_percentile=0):
+        self.pool = pool
+        self.oauth_token = oauth_token
+        self.api_url = api_url.rstrip('/')
+        self.parallel = parallel
+        self.min_part_size = min_part_size
+        self.url_ttl = url_ttl
+        self.urls = {} # resolved download URLs {file_id: (url, expires)}
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.workers = None # ThreadPool, created on first split download
+        self.attempt_workers = None # ThreadPool running attempts with a deadline
+        self.lock = Lock()
+
+        self.downloads = 0
+        self.split_downloads = 0
+        self.parts = 0
+        self.url_hits = 0
+        self.url_misses = 0
+        self.url_refreshes = 0
+        self.latency = Histogram() # of successful attempts
+        self.retried = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def _workers(self):
+        with self.lock:
+            if self.workers is None:
+                # the connection pool limits concurrency anyway
+                self.workers = ThreadPool(self.pool.max_per_host)
+            return self.workers
+
+    def _attempt_workers(self):
+        with self.lock:
+            if self.attempt_workers is None:
+                # room for attempts abandoned at their deadline and hedges
+                self.attempt_workers = ThreadPool(self.pool.max_per_host * 2)
+            return self.attempt_workers
+
+    def download(self, file_id, start, end, priority=READ, owner=None,
+            key=None):
+        '''Returns bytes from start up to, not including, end. priority,
+           owner and key are passed to the scheduler of the pool.'''
+        count = min(self.parallel, (end - start) // self.min_part_size)
+        with self.lock:
+            self.downloads += 1
+            if count > 1:
+                self.split_downloads += 1
+                self.parts += count
+
+        if count < 2:
+            return self._download((file_id, start, end, priority, owner, key))
+
+        size = -(-(end - start) // count)
+        parts = [(file_id, s, min(s + size, end), priority, owner, key)
+            for s in xrange(start, end, size)]
+        return ''.join(self._workers().map(self._download, parts))
+
+    def forget(self, file_id):
+        '''Drops the resolved download URL of a file'''
+        with self.lock:
+            self.urls.pop(file_id, None)
+
+    def _cached_url(self, file_id):
+        with self.lock:
+            url, expires = self.urls.get(file_id, (None, 0))
+            if url and expires > time.time():
+                self.url_hits += 1
+                return url
+            self.urls.pop(file_id, None)
+            self.url_misses += 1
+            return None
+
+    def _download(self, part):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.deadline or self.hedge_percentile:
+                    return self._race(part)
+                return self._attempt(part)
+            except (HTTPError, HTTPException, EnvironmentError), e:
+                if attempt == self.retries or not self._retriable(e):
+                    raise
+            with self.lock:
+                self.retried += 1
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def _retriable(self, e):
+        return not isinstance(e, HTTPError) or e.status >= 500 or e.status == 429
+
+    def _hedge_after(self):
+        '''Returns seconds after which an attempt is hedged, None if not'''
+        with self.lock:
+            if not self.hedge_percentile or \
+                    sum(self.latency.counts) < self.min_hedge_samples:
+                return None
+            return self.latency.percentile(self.hedge_percentile)
+
+    def _race(self, part):
+        '''Runs attempts in worker threads, waiting at most deadline seconds
+           and starting a hedge when the first attempt is slow. Both are
+           timed only while a request of the first attempt has a slot.'''
+        # [(event, attempt number, value)], timers put events instead of
+        # waiting with a timeout, which polls in Python 2
+        events = Queue()
+        def run(n):
+            slot = None
+            if n == 1:
+                slot = lambda held: events.put(('slot', n, (held, time.time())))
+            try:
+                events.put(('done', n, self._attempt(part, slot)))
+            except Exception:
+                events.put(('failed', n, sys.exc_info()))
+
+        timers = []
+        def alarm(seconds, event):
+            '''Puts event after seconds, returns the token it carries'''
+            token = object()
+            timer = Timer(seconds, events.put, ((event, 0, token),))
+            timer.daemon = True
+            timer.start()
+            timers.append(timer)
+            return token
+
+        workers = self._attempt_workers()
+        workers.apply_async(run, (1,))
+        started, failed = 1, 0
+        hedge_after = self._hedge_after()
+        remaining = self.deadline # seconds of deadline left
+        deadline = None # token of the running deadline alarm
+        try:
+            while True:
+                event, n, value = events.get()
+                if event == 'done':
+                    if n > 1:
+                        with self.lock:
+                            self.hedges_won += 1
+                    return value
+                if event == 'failed':
+                    failed += 1
+                    if failed == started:
+                        raise value[0], value[1], value[2]
+                elif event == 'slot':
+                    held, when = value
+                    if held:
+                        # the hedge is timed from the first request given a slot
+                        if hedge_after is not None:
+                            alarm(hedge_after, 'hedge')
+                            hedge_after = None
+                        if self.deadline:
+                            since = when
+                            deadline = alarm(remaining - (time.time() - when),
+                                'deadline')
+                    elif deadline:
+                        # paused while the next request of the attempt queues
+                        remaining -= when - since
+                        deadline = None
+                elif event == 'hedge':
+                    started += 1
+                    workers.apply_async(run, (started,))
+                    with self.lock:
+                        self.hedges += 1
+                elif value is deadline:
+                    with self.lock:
+                        self.timeouts += 1
+                    raise socket.timeout('download of %d exceeded %gs deadline' %
+                        (part[0], self.deadline))
+        finally:
+            for timer in timers:
+                timer.cancel()
+
+    def _attempt(self, part, slot=None):
+        served = [] # seconds each request took once it had a slot
+        data = self._get_range(part, served, slot)
+        with self.lock:
+            self.latency.add(sum(served))
+        return data
+
+    def _get_range(self, part, served, slot):
+        file_id, start, end, priority, owner, key = part
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1)}
+
+        url = self._cached_url(file_id)
+        if url:
+            resp = self.pool.request('GET', url, headers, priority=priority,
+                owner=owner, key=key, slot=slot)
+            served.append(resp.elapsed)
+            if resp.status not in self.expired_codes:
+                return self._body(resp, start, end, url)
+            with self.lock:
+                self.urls.pop(file_id, None)
+                self.url_refreshes += 1
+
+        url = '%s/files/%d/download?%s' % (self.api_url, file_id,
+            urlencode(dict(oauth_token=self.oauth_token)))
+        for i in range(self.max_redirects + 1):
+            resp = self.pool.request('GET', url, headers, priority=priority,
+                owner=owner, key=key, slot=slot)
+            served.append(resp.elapsed)
+            if resp.status in self.redirect_codes and 'location' in resp.headers:
+                url = urljoin(url, resp.headers['location'])
+                continue
+            body = self._body(resp, start, end, url)
+            if i and self.url_ttl:
+                with self.lock:
+                    self.urls[file_id] = (url, time.time() + self.url_ttl)
+            return body
+
+        raise HTTPError(resp.status, 'Too many redirects', self._shown(url))
+
+    def _body(self, resp, start, end, url):
+        if resp.status == 206:
+            return resp.body
+        if resp.status == 200:
+            # range is ignored by server
+            return resp.body[start:end]
+        raise HTTPError(resp.status, resp.reason, self._shown(url))
+
+    def _shown(self, url):
+        '''Returns url for error messages, without the query which holds the
+           OAuth token of API URLs and the signature of storage URLs'''
+        return url.split('?', 1)[0]
+
+    def stats(self):
+        with self.lock:
+            return dict(parallel=self.parallel, downloads=self.downloads,
+                split_downloads=self.split_downloads, parts=self.parts,
+                urls=len(self.urls), url_hits=self.url_hits,
+                url_misses=self.url_misses, url_refreshes=self.url_refreshes,
+                retried=self.retried, timeouts=self.timeouts,
+                hedges=self.hedges, hedges_won=self.hedges_won,
+                latency=self.latency.summary())
+
+    def close(self):
+        with self.lock:
+            if self.workers is not None:
+                self.workers.terminate()
+                self.workers = None
+            if self.attempt_workers is not None:
+                self.attempt_workers.terminate()
+                self.attempt_workers = None
+        self.pool.close()
@@ -268,15 +268,27 @@ class fuse_operations(Structure):
 def time_of_timespec(ts):
     return ts.tv_sec + ts.tv_nsec / 10 ** 9
 
+_st_fields = frozenset(name for name, ctype in c_stat._fields_)
+_st_times = {'st_atime': 'st_atimespec', 'st_mtime': 'st_mtimespec',
+    'st_ctime': 'st_ctimespec'}
+_st_size = sizeof(c_stat)
+
 def set_st_attrs(st, attrs):
-    for key, val in attrs.items():
-        if key in ('st_atime', 'st_mtime', 'st_ctime'):
-            timespec = getattr(st, key + 'spec')
+    for key, val in attrs.iteritems():
+        if key in _st_times:
+            timespec = getattr(st, _st_times[key])
             timespec.tv_sec = int(val)
             timespec.tv_nsec = int((val - timespec.tv_sec) * 10 ** 9)
-        elif hasattr(st, key):
+        elif key in _st_fields:
             setattr(st, key, val)
 
+def pack_stat(attrs):
+    """Returns attrs as the bytes of a c_stat. getattr and readdir may
+       return these instead of a dict, they are copied as is."""
+    st = c_stat()
+    set_st_attrs(st, attrs)
+    return string_at(addressof(st), _st_size)
+
 
 def fuse_get_context():
     """Returns a (uid, gid, pid) tuple"""
@@ -302,6 +314,7 @@ class FUSE(object):
         
         self.operations = operations
         self.raw_fi = raw_fi
+        self.use_readinto = getattr(operations, 'readinto', None) is not None
         args = ['fuse']
         if kwargs.pop('foreground', False):
             args.append('-f')
@@ -316,6 +329,7 @@ class FUSE(object):
         args.append(mountpoint)
         argv = (c_char_p * len(args))(*args)
         
+        operations.bind()
         fuse_ops = fuse_operations()
         for name, prototype in fuse_operations._fields_:
             if prototype != c_voidp and getattr(operations, name, None):
@@ -391,12 +405,16 @@ class FUSE(object):
     
     def read(self, path, buf, size, offset, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
+        if self.use_readinto:
+            view = memoryview(cast(buf, POINTER(c_char * size)).contents)
+            return self.operations('readinto', path, view, offset, fh)
+        
         ret = self.operations('read', path, size, offset, fh)
         if not ret:
             return 0
-        data = create_string_buffer(ret[:size], size)
-        memmove(buf, data, size)
-        return size
+        retsize = min(len(ret), size)
+        memmove(buf, ret, retsize)
+        return retsize
     
     def write(self, path, buf, size, offset, fip):
         data = string_at(buf, size)
@@ -457,17 +475,22 @@ class FUSE(object):
     
     def readdir(self, path, buf, filler, offset, fip):
         # Ignore raw_fi
+        st = c_stat()   # filler copies the stat, one buffer is reused
         for item in self.operations('readdir', path, fip.contents.fh):
             if isinstance(item, str):
-                name, st, offset = item, None, 0
+                name, stp, offset = item, None, 0
             else:
                 name, attrs, offset = item
-                if attrs:
-                    st = c_stat()
+                if isinstance(attrs, str):
+                    memmove(byref(st), attrs, _st_size)
+                    stp = st
+                elif attrs:
+                    memset(byref(st), 0, _st_size)
                     set_st_attrs(st, attrs)
+                    stp = st
                 else:
-                    st = None
-            if filler(buf, name, st, offset) != 0:
+                    stp = None
+            if filler(buf, name, stp, offset) != 0:
                 break
         return 0
     
@@ -501,11 +524,13 @@ class FUSE(object):
         return self.operations('truncate', path, length, fh)
     
     def fgetattr(self, path, buf, fip):
-        memset(buf, 0, sizeof(c_stat))
-        st = buf.contents
         fh = fip and (fip.contents if self.raw_fi else fip.contents.fh)
         attrs = self.operations('getattr', path, fh)
-        set_st_attrs(st, attrs)
+        if isinstance(attrs, str):
+            memmove(buf, attrs, _st_size)
+        else:
+            memset(buf, 0, _st_size)
+            set_st_attrs(buf.contents, attrs)
         return 0
     
     def lock(self, path, fip, cmd, lock):
@@ -533,10 +558,27 @@ class Operations(object):
        When in doubt of what an operation should do, check the FUSE header
        file or the corresponding system call man page."""
     
+    dispatch = None     # {name: bound method}, set by bind
+    
+    def bind(self):
+        """Looks up the operations once instead of on every call. FUSE calls
+           it at mount."""
+        self.dispatch = dispatch = {}
+        for name in vars(Operations):
+            method = getattr(self, name)
+            if not name.startswith('_') and callable(method):
+                dispatch[name] = method
+    
     def __call__(self, op, *args):
-        if not hasattr(self, op):
+        if self.dispatch is None:
+            if not hasattr(self, op):
+                raise FuseOSError(EFAULT)
+            return getattr(self, op)(*args)
+        try:
+            method = self.dispatch[op]
+        except KeyError:
             raise FuseOSError(EFAULT)
-        return getattr(self, op)(*args)
+        return method(*args)
     
     def access(self, path, amode):
         return 0
@@ -571,7 +613,7 @@ class Operations(object):
     
     def getattr(self, path, fh=None):
         """Returns a dictionary with keys identical to the stat C structure
-           of stat(2).
+           of stat(2), or the bytes returned by pack_stat.
            st_atime, st_mtime and st_ctime should be floats.
            NOTE: There is an incombatibility between Linux and Mac OS X concerning
            st_nlink of directories. Mac OS X counts all files inside the directory,
@@ -619,9 +661,14 @@ class Operations(object):
         """Returns a string containing the data requested."""
         raise FuseOSError(EIO)
     
+    # When set, readinto(self, path, buf, offset, fh) is called instead of
+    # read. buf is a writable memoryview of the kernel buffer, readinto
+    # should fill it and return the number of bytes read.
+    readinto = None
+    
     def readdir(self, path, fh):
         """Can return either a list of names, or a list of (name, attrs, offset)
-           tuples. attrs is a dict as in getattr."""
+           tuples. attrs is a dict or packed bytes as in getattr."""
         return ['.', '..']
     
     def readlink(self, path):
@@ -0,0 +1,16 @@
+class Handle(object):
+    """State of an open file, kept for its file handle number.
+
+    A handle reads an Entry (file), writes a WriteBuffer (buffer) or serves
+    fixed contents (data). Only a handle that created its buffer uploads it
+    on release."""
+
+    __slots__ = ('file', 'readahead', 'buffer', 'created', 'data')
+
+    def __init__(self, file=None, readahead=None, buffer=None, created=False,
+            data=None):
+        self.file = file
+        self.readahead = readahead
+        self.buffer = buffer
+        self.created = created
+        self.data = data
@@ -0,0 +1,182 @@
+import httplib
+import socket
+from errno import ECONNRESET, EPIPE
+from threading import BoundedSemaphore, Lock
+from time import time
+from urlparse import urlsplit
+
+from scheduler import READ
+from stats import Histogram
+
+
+class HTTPError(Exception):
+    def __init__(self, status, reason, url):
+        super(HTTPError, self).__init__('%d %s: %s' % (status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+
+class Response(object):
+    def __init__(self, status, reason, headers, body, elapsed=0):
+        self.status = status
+        self.reason = reason
+        self.headers = headers # {lowercase name: value}
+        self.body = body
+        self.elapsed = elapsed # seconds from sending the request to the end of body
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP and HTTPS connections shared between threads.
+
+    At most max_per_host requests are in flight to a single host at a time,
+    idle connections are kept open and reused by later requests. When a
+    scheduler is set, requests wait for it in their priority class first."""
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection,
+    }
+
+    def __init__(self, max_per_host=8, timeout=30):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.scheduler = None # IOScheduler
+        self.idle = {} # {(scheme, netloc): [connection]}
+        self.slots = {} # {(scheme, netloc): BoundedSemaphore}
+        self.lock = Lock()
+
+        self.created = 0
+        self.reused = 0
+        self.requests = 0
+        self.latency = Histogram()
+
+    def _slot(self, key):
+        with self.lock:
+            try:
+                return self.slots[key]
+            except KeyError:
+                slot = self.slots[key] = BoundedSemaphore(self.max_per_host)
+                return slot
+
+    def _connection(self, key, timeout, new=False):
+        '''Returns (connection, reused), a new connection if new is set'''
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle and not new:
+                self.reused += 1
+                conn = idle.pop()
+                conn.sock.settimeout(timeout)
+                return conn, True
+            self.created += 1
+
+        scheme, netloc = key
+        return self.connection_classes[scheme](netloc, timeout=timeout), False
+
+    def _release(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def request(self, method, url, headers=None, body=None, timeout=None,
+            priority=READ, owner=None, key=None, slot=None):
+        '''Makes a request and reads the whole response body.
+           body can be a string or a file-like object with read() and
+           seek(), which is sent in blocks. priority, owner and key are
+           passed to the scheduler. slot is called with True once the
+           request has a slot of the scheduler, and with False when the
+           slot is given back.'''
+        if self.scheduler is None:
+            if slot:
+                slot(True)
+            try:
+                return self._request(method, url, headers, body, timeout)
+            finally:
+                if slot:
+                    slot(False)
+
+        ticket = self.scheduler.acquire(priority, owner, key)
+        if slot:
+            slot(True)
+        nbytes = 0
+        try:
+            resp = self._request(method, url, headers, body, timeout)
+            if isinstance(body, str):
+                nbytes = len(body)
+            elif body is not None:
+                nbytes = int(headers.get('Content-Length', 0))
+            nbytes += len(resp.body)
+            return resp
+        finally:
+            self.scheduler.release(ticket, nbytes)
+            if slot:
+                slot(False)
+
+    def _request(self, method, url, headers, body, timeout):
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            path += '?' + query
+        key = (scheme, netloc)
+        if timeout is None:
+            timeout = self.timeout
+
+        slot = self._slot(key)
+        slot.acquire()
+        try:
+            with self.lock:
+                self.requests += 1
+            start = time()
+            conn, reused = self._connection(key, timeout)
+            while True:
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                try:
+                    conn.request(method, path or '/', body, headers or {})
+                    resp = conn.getresponse()
+                except (httplib.HTTPException, socket.error), e:
+                    conn.close()
+                    if reused and body is None and self._stale(e):
+                        # the server closed the idle connection, the request
+                        # was not processed and is sent once more
+                        conn, reused = self._connection(key, timeout, new=True)
+                        continue
+                    raise
+                try:
+                    data = resp.read()
+                except:
+                    conn.close()
+                    raise
+                break
+
+            elapsed = time() - start
+            with self.lock:
+                self.latency.add(elapsed)
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return Response(resp.status, resp.reason, dict(resp.getheaders()),
+                data, elapsed)
+        finally:
+            slot.release()
+
+    def _stale(self, e):
+        '''Tells if e is how a kept-alive connection closed by the server
+           fails, before any response. Timeouts are not, the server may
+           have got the request.'''
+        if isinstance(e, httplib.BadStatusLine):
+            return True
+        return isinstance(e, socket.error) and \
+            not isinstance(e, socket.timeout) and e.errno in (ECONNRESET, EPIPE)
+
+    def stats(self):
+        with self.lock:
+            idle = sum(len(conns) for conns in self.idle.values())
+            return dict(requests=self.requests, created=self.created,
+                reused=self.reused, idle=idle, latency=self.latency.summary())
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
@@ -0,0 +1,56 @@
+from stat import S_IFDIR, S_IFREG, S_ISDIR
+
+from fuse import pack_stat
+
+DIRECTORY = 'application/x-directory'
+
+
+class Entry(object):
+    """Metadata of a file kept for the lifetime of the mount.
+
+    Only the fields needed to serve getattr and readdir are kept, the API
+    object the entry is made of is thrown away. The packed stat is made on
+    the first getattr or readdir of the entry."""
+
+    __slots__ = ('id', 'parent_id', 'name', 'mode', 'size', 'mtime', 'packed')
+
+    def __init__(self, id, parent_id, name, mode, size, mtime):
+        self.id = id
+        self.parent_id = parent_id
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+        self.packed = None
+
+    @classmethod
+    def from_file(cls, file, mtime):
+        '''Creates an entry from a putio2.File'''
+        name = file.name
+        if isinstance(name, unicode):
+            # paths in the mount are byte strings
+            name = name.encode('utf-8')
+        if file.content_type == DIRECTORY:
+            return cls(file.id, file.parent_id, name, S_IFDIR | 0700, 0, mtime)
+        return cls(file.id, file.parent_id, name, S_IFREG | 0400, file.size, mtime)
+
+    @property
+    def is_dir(self):
+        return S_ISDIR(self.mode)
+
+    def stat(self):
+        return dict(
+            st_mode=self.mode,
+            st_ctime=self.mtime,
+            st_mtime=self.mtime,
+            st_atime=self.mtime,
+            st_size=self.size,
+            st_blksize=1000000
+            # st_blksize a filesystem-specific preferred I/O block size for this object.
+            # but, nobody seems to respect it.
+        )
+
+    def packed_stat(self):
+        if self.packed is None:
+            self.packed = pack_stat(self.stat())
+        return self.packed
@@ -0,0 +1,81 @@
+import logging
+from Queue import Queue
+from random import random
+from threading import Thread
+
+logger = logging.getLogger('putiofs.ops')
+
+
+class QueueHandler(logging.Handler):
+    """Passes records to a thread which formats and writes them with
+    handler, so the logging threads never block on output.
+
+    Queued records are written out by flush and close, which
+    logging.shutdown calls at exit."""
+
+    def __init__(self, handler):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.queue = Queue()
+        self.thread = Thread(target=self._work, name='log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        if self.thread.is_alive():
+            self.queue.put(record)
+        else:
+            # closed, nothing would take it from the queue
+            self.handler.handle(record)
+
+    def flush(self):
+        '''Waits until the queued records are written'''
+        if self.thread.is_alive():
+            self.queue.join()
+        self.handler.flush()
+
+    def close(self):
+        '''Writes the queued records and stops the thread'''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.handler.close()
+        logging.Handler.close(self)
+
+    def _work(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.handler.handle(record)
+            except Exception:
+                self.handler.handleError(record)
+            finally:
+                self.queue.task_done()
+
+
+class LoggingMixIn(object):
+    """Logs a sample of FUSE operations.
+
+    Nothing is done unless log_sample is set and the logger is enabled for
+    DEBUG. Arguments are formatted by the handler, not on the calling
+    thread."""
+
+    log_sample = 0 # fraction of operations to log
+
+    def __call__(self, op, *args):
+        if not (self.log_sample and random() < self.log_sample and
+                logger.isEnabledFor(logging.DEBUG)):
+            return super(LoggingMixIn, self).__call__(op, *args)
+
+        logger.debug('-> %s %r', op, args)
+        ret = '[Unhandled Exception]'
+        try:
+            ret = super(LoggingMixIn, self).__call__(op, *args)
+            return ret
+        except OSError, e:
+            ret = str(e)
+            raise
+        finally:
+            logger.debug('<- %s %r', op, ret)
@@ -0,0 +1,116 @@
+import logging
+import mimetypes
+from Queue import Queue
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class ReadAhead(object):
+    """Access pattern of a single file handle.
+
+    The window doubles on every sequential read up to max_window blocks and
+    collapses to zero on a seek."""
+
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.window = 0
+        self.last_block = None
+        self.prefetched = -1 # last block index given out for prefetching
+        self.lock = Lock() # the kernel may read a handle from several threads
+
+    def access(self, first, last):
+        '''Records a read of blocks first..last, returns the blocks to prefetch'''
+        with self.lock:
+            return self._access(first, last)
+
+    def _access(self, first, last):
+        sequential = self.last_block is not None and \
+            self.last_block <= first <= self.last_block + 1
+        self.last_block = last
+
+        if not sequential:
+            self.window = 0
+            self.prefetched = last
+            return []
+
+        self.window = min(max(self.window * 2, 1), self.max_window)
+        start = max(last, self.prefetched) + 1
+        self.prefetched = max(self.prefetched, last + self.window)
+        return range(start, self.prefetched + 1)
+
+
+class OpenPrefetch(object):
+    """Regions of a file to fetch when it is opened.
+
+    The first head and last tail bytes of matching files are fetched, so
+    players reading the header and then the index at the end (MP4 moov,
+    MKV cues) don't wait on a cold seek. A pattern is an extension like
+    '.mkv' or the start of a content type like 'video/', the type is
+    guessed from the file name."""
+
+    def __init__(self, head, tail, patterns):
+        self.head = head
+        self.tail = tail
+        self.extensions = set(p.lower() for p in patterns if p.startswith('.'))
+        self.types = tuple(p for p in patterns if not p.startswith('.'))
+
+    def matches(self, name):
+        ext = name[name.rfind('.'):].lower() if '.' in name else ''
+        if ext in self.extensions:
+            return True
+        type = mimetypes.guess_type(name)[0]
+        return bool(type and type.startswith(self.types))
+
+    def blocks(self, file, block_size):
+        '''Returns indexes of the blocks to fetch when file is opened'''
+        if not file.size or not (self.head or self.tail) or not self.matches(file.name):
+            return []
+        last = (file.size - 1) // block_size
+        head = range(min(-(-self.head // block_size), last + 1))
+        tail_start = max((file.size - self.tail) // block_size, len(head))
+        return head + range(tail_start, last + 1) if self.tail else head
+
+
+class Prefetcher(object):
+    """Fetches blocks in background worker threads"""
+
+    def __init__(self, fetch, workers):
+        self.fetch = fetch # fetch(file, index)
+        self.workers = workers
+        self.queue = Queue()
+        self.pending = set() # {(file_id, index)}
+        self.lock = Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            t = Thread(target=self._work, name='prefetch-%d' % i)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        for i in range(self.workers):
+            self.queue.put(None)
+
+    def schedule(self, file, index):
+        key = (file.id, index)
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        self.queue.put((file, index))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            file, index = item
+            try:
+                self.fetch(file, index)
+            except Exception:
+                logger.exception('prefetch of block %d of %s failed', index, file.id)
+            finally:
+                with self.lock:
+                    self.pending.discard((file.id, index))
@@ -1,184 +1,553 @@
 #!/usr/bin/env python
 
 import os
+import json
 import logging
 import argparse
 
-from errno import ENOENT, EROFS
+from errno import EIO, ENOENT, EROFS, EXDEV
 from stat import S_IFDIR, S_IFLNK, S_IFREG
 from sys import argv, exit
 from time import time
-from tempfile import NamedTemporaryFile
+from itertools import count
+from threading import Event, RLock, Thread
+from httplib import HTTPException
 from pdb import set_trace as st
 
 import putio2
-from fuse import FUSE, FuseOSError, Operations, LoggingMixIn
+from fuse import FUSE, FuseOSError, Operations
+from cache import BlockCache
+from prefetch import OpenPrefetch, Prefetcher, ReadAhead
+from httppool import ConnectionPool, HTTPError
+from download import API_URL, Downloader
+from snapshot import Snapshot
+from upload import UPLOAD_URL, UploadManager
+from sync import Syncer
+from metadata import Entry
+from handle import Handle
+from writebuf import MemoryBudget, WriteBuffer
+from singleflight import SingleFlight
+from scheduler import CLASS_NAMES, PREFETCH, READ, IOScheduler
+from stats import Metrics, MetricsMixIn
+from oplog import LoggingMixIn, QueueHandler
 
 now = time()
 
-class PutioFS(LoggingMixIn, Operations):
+STATS_PATH = '/.putiofs-stats'
+
+class PutioFS(MetricsMixIn, LoggingMixIn, Operations):
     """Implementation of put.io filesystem"""
     
-    def __init__(self):
-        self.fd = 0
-        self.temporary_files = {} # buffer area before uploading {path: TemporaryFile}
+    def __init__(self, downloader, uploader, syncer, cache, prefetch_workers=4,
+            max_readahead=16, preload=False, dir_ttl=60, snapshot=None,
+            snapshot_interval=300, write_memory=64 * 1024 * 1024,
+            spill_size=1024 * 1024, open_prefetch=None):
+        self.fds = count(1) # file handles, next() is atomic
+        self.write_buffers = {} # files being written {path: WriteBuffer}
+        self.write_budget = MemoryBudget(write_memory)
+        self.spill_size = spill_size
+        self.downloader = downloader
+        self.uploader = uploader
+        uploader.done = self._uploaded
+        self.syncer = syncer
+        if syncer:
+            syncer.apply = self._sync
+        self.cache = cache
+        self.block_fetches = SingleFlight() # {(file_id, index): Call}
+        self.listings = SingleFlight() # {dir_id: Call}
+        self.handles = {} # open files {fh: Handle}
+        # file in kernel page cache {path: (id, size)}, dropped with the
+        # cached path when the file is gone
+        self.page_cache = {}
+        self.max_readahead = max_readahead
+        self.prefetcher = Prefetcher(self._prefetch_block, prefetch_workers)
+        self.open_prefetch = open_prefetch
+        self.preload = preload
+        self.dir_ttl = dir_ttl
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self.stopped = Event()
+        
+        # Guards changes to files, children, listed and path_files. Lookups
+        # don't take it: dicts are only changed by single item operations,
+        # or replaced after being built, and path_files is only added to if
+        # no path was forgotten since the lookup started.
+        self.lock = RLock()
+        self.generation = 0 # incremented when paths are forgotten
+        
+        self.metrics = Metrics()
         self._fetch_files()
     
     def _fetch_files(self):
-        '''Fetch all files from put.io''' 
+        '''Creates the file indexes from the snapshot if there is one,
+           fetches all files from put.io if preloading'''
         
-        # -1 means all files
-        self.files = client.File.list(-1, as_dict=True)
-        # as {id: file}
+        self.loaded_snapshot = False
+        if self.snapshot:
+            loaded = self.snapshot.load()
+            if loaded:
+                entries, listed = loaded
+                self._set_files(entries, listed)
+                self.loaded_snapshot = True
+                return
+        
+        if self.preload:
+            # -1 means all files
+            self._set_files(self._list(-1))
+        else:
+            self._set_files([])
+    
+    def _set_files(self, files, listed=()):
+        '''Replaces the file indexes with files and root'''
         
         # create root
-        self.files[0] = client.File(dict(id=0, name='Your Files',
-            content_type='application/x-directory',
-            parent_id=None))
+        root = Entry(0, None, 'Your Files', S_IFDIR | 0700, 0, now)
         
-        # attact stat object to files
-        for f in self.files.values():
-            self._attach_stat(f)
+        by_id = {} # as {id: file}
+        children = {} # files indexed by parent as {parent_id: {name: file}}
+        for f in [root] + list(files):
+            by_id[f.id] = f
+            if f.parent_id is not None:
+                children.setdefault(f.parent_id, {})[f.name] = f
         
-        # same files by indexed with path
-        self.path_files = {}
-        for f in self.files.values():
-            path = self._construct_path(f)
-            self.path_files[path] = f
-    
-    def _add_to_files(self, file):
-        self.files[file.id] = file
-        path = self._construct_path(file)
-        self.path_files[path] = file
-        self._attach_stat(file)
-    
-    def _attach_stat(self, file):
-        if file.content_type == 'application/x-directory':
-            mode = (S_IFDIR | 0700)
-            size = 0
-        else:
-            mode = (S_IFREG | 0400)
-            size = file.size
+        with self.lock:
+            self.files, self.children = by_id, children
             
-        file.stat = dict(
-            st_mode=mode,
-            st_ctime=now,
-            st_atime=now,
-            st_size=size,
-            st_blksize=1000000
-            # st_blksize a filesystem-specific preferred I/O block size for this object.
-            # but, nobody seems to respect it.
-        )
+            # directories listed from put.io as {id: time of listing}
+            self.listed = dict.fromkeys(listed, time())
             
-    def _construct_path(self, file):
-        '''For given file, returns the path to the mount point'''
+            # files indexed by path, filled lazily by _get_file_by_path
+            self.path_files = {'/': root}
+            self.generation += 1
+    
+    def _reconcile(self):
+        '''Brings the files loaded from snapshot up to date with put.io'''
+        if self.preload:
+            files = self._list(-1)
+            self._drop_changed(files)
+            self._set_files(files)
+            return
         
-        if file.id == 0:
-            return '/'
+        for id in self.listed.keys():
+            dir = self.files.get(id)
+            if dir:
+                self._list_directory(dir, force=True)
+    
+    def _save_snapshot(self):
+        files = [f for f in self.files.values() if f.id != 0]
+        self.snapshot.save(files, self.listed.keys())
+    
+    def _snapshot_loop(self):
+        if self.loaded_snapshot:
+            try:
+                self._reconcile()
+            except Exception:
+                logging.exception('cannot reconcile snapshot')
         
-        path = str(file)
-
-        parent_id = file.parent_id
-        while parent_id:
-            parent = self.files[parent_id]
-            path = str(parent) + '/' + path
-
-            parent_id = parent.parent_id
-
-        return '/' + path
+        while not self.stopped.wait(self.snapshot_interval):
+            try:
+                self._save_snapshot()
+            except Exception:
+                logging.exception('cannot save snapshot')
+    
+    def _list(self, parent_id):
+        '''Fetches children of parent_id from put.io as [Entry]'''
+        return [Entry.from_file(f, now) for f in
+            client.File.list(parent_id, as_dict=True).itervalues()]
+    
+    def _drop_changed(self, files):
+        '''Drops cached blocks of files whose content changed on put.io'''
+        for f in files:
+            old = self.files.get(f.id)
+            if old is not None and old.size != f.size:
+                self.cache.discard_file(f.id)
+                self.downloader.forget(f.id)
+    
+    def _api_file(self, file):
+        '''Returns putio2.File for calling the API on an entry'''
+        return client.File(dict(id=file.id, name=file.name,
+            parent_id=file.parent_id, size=file.size))
+    
+    def _list_directory(self, dir, path=None, force=False):
+        '''Fetches children of dir unless they are preloaded or listed recently.
+           Returns True if children have changed since the last listing.'''
+        if (self.preload and not force) or not dir.is_dir:
+            return False
         
+        listed = self.listed.get(dir.id)
+        if not force and listed is not None and time() - listed < self.dir_ttl:
+            return False
+        
+        if force:
+            # a listing in flight may have started before the change
+            return self._fetch_directory(dir, path)
+        return self.listings.do(dir.id, self._fetch_directory, dir, path)
+    
+    def _fetch_directory(self, dir, path):
+        files = dict((f.id, f) for f in self._list(dir.id))
+        
+        with self.lock:
+            old = dict(self.children.get(dir.id, {}))
+            for f in old.values():
+                if f.id not in files:
+                    self._remove_from_files(f)
+                    self.cache.discard_file(f.id)
+            self._drop_changed(files.values())
+            
+            changed = sorted((f.id, f.name, f.size) for f in old.values()) != \
+                sorted((f.id, f.name, f.size) for f in files.values())
+            
+            # swap in a complete dict, lookups never see a partial listing
+            children = {}
+            for f in files.values():
+                self.files[f.id] = f
+                children[f.name] = f
+            self.children[dir.id] = children
+            self.listed[dir.id] = time()
+            
+            # records of the children are replaced, resolve their paths again
+            if path is None:
+                path = self._path_of(dir)
+            self._forget_children(path, old, children)
+        return changed
+    
+    def _sync(self, dir_ids):
+        '''Relists directories changed on put.io, returns True if any changed'''
+        changed = False
+        for id in dir_ids:
+            dir = self.files.get(id)
+            if dir is not None and (self.preload or id in self.listed):
+                changed |= self._list_directory(dir, force=True)
+        return changed
+    
+    def _add_to_files(self, file):
+        with self.lock:
+            self.files[file.id] = file
+            if file.parent_id is not None:
+                self.children.setdefault(file.parent_id, {})[file.name] = file
+    
+    def _remove_from_files(self, file):
+        with self.lock:
+            self.files.pop(file.id, None)
+            self.children.get(file.parent_id, {}).pop(file.name, None)
+            self.listed.pop(file.id, None)
+            for child in self.children.pop(file.id, {}).values():
+                self._remove_from_files(child)
+    
     def _get_file_by_path(self, path):
-        return self.path_files[path]
+        '''Resolves path through the parent's cached path, raises KeyError'''
+        file = self.path_files.get(path)
+        if file is not None:
+            return file
+        
+        generation = self.generation
+        dirname, basename = os.path.split(path)
+        parent = self._get_file_by_path(dirname)
+        self._list_directory(parent, dirname)
+        file = self.children[parent.id][basename]
+        with self.lock:
+            if generation == self.generation:
+                self.path_files[path] = file
+        return file
+    
+    def _path_of(self, file):
+        '''Returns path of file in the mount'''
+        names = []
+        while file.parent_id is not None:
+            names.append(file.name)
+            file = self.files[file.parent_id]
+        return '/' + '/'.join(reversed(names))
+    
+    def _forget_path(self, path):
+        '''Drops cached path and paths under it'''
+        with self.lock:
+            self.generation += 1
+            self.path_files.pop(path, None)
+            self.page_cache.pop(path, None)
+            prefix = path.rstrip('/') + '/'
+            for p in [p for p in self.path_files if p.startswith(prefix) and p != '/']:
+                del self.path_files[p]
+            # open adds to page_cache without the lock, keys() is a copy
+            for p in [p for p in self.page_cache.keys() if p.startswith(prefix)]:
+                self.page_cache.pop(p, None)
+    
+    def _forget_children(self, path, old, new):
+        '''Drops cached paths of the children of path listed as old and new.
+           Subtrees are only dropped under children that are gone or have
+           been replaced by another file, others still resolve the same.'''
+        with self.lock:
+            self.generation += 1
+            prefix = path.rstrip('/') + '/'
+            gone = []
+            for name in set(old) | set(new):
+                self.path_files.pop(prefix + name, None)
+                if name in old and (name not in new or new[name].id != old[name].id):
+                    self.page_cache.pop(prefix + name, None)
+                    gone.append(prefix + name + '/')
+            if gone:
+                gone = tuple(gone)
+                for p in [p for p in self.path_files if p.startswith(gone)]:
+                    del self.path_files[p]
+                for p in [p for p in self.page_cache.keys() if p.startswith(gone)]:
+                    self.page_cache.pop(p, None)
     
     def _get_file_by_id(self, id):
         return self.files[id]
     
     def _children(self, file):
-        return filter(lambda f: f.parent_id == file.id, self.files.values())
-         
-    def create(self, path, mode):
-        if path in self.temporary_files:
+        return self.children.get(file.id, {}).values()
+    
+    def _read_block(self, file, index, priority=READ, owner=None):
+        '''Returns the block at index of file, from cache if possible'''
+        key = (file.id, index)
+        data = self.cache.get(key)
+        if data is None:
+            # readers of the same block wait for a single download, which
+            # runs in the most urgent class of its readers
+            scheduler = self.downloader.pool.scheduler
+            if scheduler:
+                scheduler.want(key, priority)
+            try:
+                data = self.block_fetches.do(key, self._fetch_block, file,
+                    index, priority, owner)
+            finally:
+                if scheduler:
+                    scheduler.unwant(key, priority)
+        return data
+    
+    def _fetch_block(self, file, index, priority, owner):
+        start = index * self.cache.block_size
+        end = min(start + self.cache.block_size, file.size)
+        try:
+            data = self.downloader.download(file.id, start, end, priority,
+                owner, (file.id, index))
+        except (HTTPError, HTTPException, EnvironmentError), e:
+            logging.warning('download of %s failed: %s', file.id, e)
+            raise FuseOSError(EIO)
+        self.cache.put((file.id, index), data)
+        return data
+    
+    def _prefetch_block(self, file, index):
+        if (file.id, index) not in self.cache:
+            self._read_block(file, index, PREFETCH, file.id)
+    
+    def _uploaded(self, upload, file):
+        self._add_to_files(Entry.from_file(client.File(file), time()))
+    
+    def _stats(self):
+        '''Returns contents of the stats file'''
+        return json.dumps(dict(
+            ops=self.metrics.summary(),
+            cache=self.cache.stats(),
+            http=self.downloader.pool.stats(),
+            downloads=self.downloader.stats(),
+            writes=self.write_budget.stats(),
+            single_flight=dict(blocks=self.block_fetches.stats(),
+                listings=self.listings.stats()),
+            scheduler=self.downloader.pool.scheduler and
+                self.downloader.pool.scheduler.stats(),
+        ), indent=2, sort_keys=True) + '\n'
+    
+    def _open(self, fi, handle):
+        fi.fh = next(self.fds)
+        self.handles[fi.fh] = handle
+        return 0
+    
+    def _read_range(self, handle, size, offset):
+        '''Returns [(block, start, end)], the parts of cached blocks to read'''
+        f = handle.file
+        end = min(offset + size, f.size)
+        if offset >= end:
+            return []
+        
+        block_size = self.cache.block_size
+        first, last = offset // block_size, (end - 1) // block_size
+        chunks = []
+        for index in xrange(first, last + 1):
+            block = self._read_block(f, index, READ, handle)
+            start = index * block_size
+            chunks.append((block, max(offset - start, 0), min(end - start, len(block))))
+        
+        if handle.readahead:
+            last_block = (f.size - 1) // block_size
+            for index in handle.readahead.access(first, last):
+                if index > last_block:
+                    break
+                self.prefetcher.schedule(f, index)
+        return chunks
+    
+    def init(self, path):
+        self.prefetcher.start()
+        self.uploader.start()
+        if self.syncer:
+            self.syncer.start()
+        if self.snapshot:
+            t = Thread(target=self._snapshot_loop, name='snapshot')
+            t.daemon = True
+            t.start()
+    
+    def destroy(self, path):
+        self.stopped.set()
+        if self.syncer:
+            self.syncer.stop()
+        if self.snapshot:
+            try:
+                self._save_snapshot()
+            except Exception:
+                logging.exception('cannot save snapshot')
+        self.prefetcher.stop()
+        self.uploader.stop()
+        self.cache.close()
+        self.downloader.close()
+    
+    def create(self, path, mode, fi):
+        if self.uploader.get(path):
+            # the file can't be replaced before its upload is confirmed
             raise FuseOSError(EROFS)
         
-        self.temporary_files[path] = NamedTemporaryFile(delete=False)
-
-        self.fd += 1
-        return self.fd
+        buffer = WriteBuffer(self.write_budget, self.spill_size)
+        if self.write_buffers.setdefault(path, buffer) is not buffer:
+            raise FuseOSError(EROFS)
+        
+        return self._open(fi, Handle(buffer=buffer, created=True))
     
     def getattr(self, path, fh=None):
+        buffer = self.write_buffers.get(path)
+        if buffer:
+            return buffer.stat()
+        
+        if path == STATS_PATH:
+            return dict(st_mode=(S_IFREG | 0444), st_size=len(self._stats()),
+                st_ctime=now, st_mtime=now, st_atime=now)
+        
+        # uploaded files are shown with local attributes until confirmed
+        upload = self.uploader.get(path)
+        if upload:
+            return upload.buffer.stat()
+        
         try:
-            f = self.temporary_files[path]
+            file = self._get_file_by_path(path)
         except KeyError:
-            pass
-        else:
-            st = os.lstat(f.name)
-            return dict((key, getattr(st, key)) for key in ('st_atime', 'st_ctime',
-                'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid'))
-            
-        if path not in self.path_files:
             raise FuseOSError(ENOENT)
-            
-        file = self._get_file_by_path(path)
-        return file.stat
+        return file.packed_stat()
     
     def mkdir(self, path, mode):
         dirname, basename = os.path.split(path)
         parent = self._get_file_by_path(dirname)
         newdir = client.File.create_folder(parent_id=parent.id)
-        self._add_to_files(newdir)
+        self._add_to_files(Entry.from_file(newdir, time()))
 
-    def open(self, path, flags):
-        self.fd += 1
-        return self.fd
+    def open(self, path, fi):
+        buffer = self.write_buffers.get(path)
+        if buffer:
+            return self._open(fi, Handle(buffer=buffer))
+        
+        if path == STATS_PATH:
+            # contents are fixed at open, their size may differ from getattr
+            fi.direct_io = True
+            return self._open(fi, Handle(data=self._stats()))
+        
+        try:
+            f = self._get_file_by_path(path)
+        except KeyError:
+            # removed since the kernel looked it up
+            raise FuseOSError(ENOENT)
+        
+        # pages kept by the kernel are valid unless the file has changed
+        # since it was last opened
+        version = (f.id, f.size)
+        fi.keep_cache = self.page_cache.get(path) == version
+        self.page_cache[path] = version
+        
+        if self.open_prefetch and not fi.keep_cache:
+            for index in self.open_prefetch.blocks(f, self.cache.block_size):
+                self.prefetcher.schedule(f, index)
+        
+        return self._open(fi, Handle(f, ReadAhead(self.max_readahead)))
     
-    def read(self, path, size, offset, fh):
-        f = self._get_file_by_path(path)
-        return f.download(range=(offset, offset+size))
+    def read(self, path, size, offset, fi):
+        handle = self.handles[fi.fh]
+        if handle.data is not None:
+            return handle.data[offset:offset + size]
+        chunks = self._read_range(handle, size, offset)
+        return ''.join(block[start:end] for block, start, end in chunks)
     
-    def readdir(self, path, fh):
-        f = self._get_file_by_path(path)
-        children = self._children(f)
-        return ['.', '..'] + [str(c) for c in children]
+    def readinto(self, path, buf, offset, fi):
+        handle = self.handles[fi.fh]
+        if handle.data is not None:
+            data = handle.data[offset:offset + len(buf)]
+            buf[:len(data)] = data
+            return len(data)
+        
+        pos = 0
+        for block, start, end in self._read_range(handle, len(buf), offset):
+            n = end - start
+            buf[pos:pos + n] = buffer(block, start, n)
+            pos += n
+        return pos
     
-    def release(self, path, fh):
+    def readdir(self, path, fh):
         try:
-            f = self.temporary_files[path]
+            f = self._get_file_by_path(path)
         except KeyError:
-            # no need to close files which are opened for reading
-            pass
-        else:
-            temppath = f.name
-            f.close()
+            raise FuseOSError(ENOENT)
+        self._list_directory(f, path)
+        children = self._children(f)
+        entries = ['.', '..'] + [(c.name, c.packed_stat(), 0) for c in children]
         
+        names = set(c.name for c in children)
+        for u in self.uploader.in_directory(f.id):
+            if u.name not in names:
+                entries.append((u.name, u.buffer.stat(), 0))
+        return entries
+    
+    def release(self, path, fi):
+        handle = self.handles.pop(fi.fh)
+        if handle.created:
+            buffer = handle.buffer
+            del self.write_buffers[path]
+            
+            dirname, filename = os.path.split(path)
             try:
-                filename = os.path.basename(path)
-                newfile = client.File.upload(temppath, filename)
-                self._add_to_files(newfile)
-            finally:
-                os.remove(temppath)
-                del self.temporary_files[path]
+                parent = self._get_file_by_path(dirname)
+            except KeyError:
+                buffer.close()
+                raise FuseOSError(ENOENT)
+            self.uploader.submit(path, buffer, parent.id, filename)
 
     def rename(self, old, new):
+        if os.path.dirname(old) != os.path.dirname(new):
+            # only renames in place, mv copies and deletes instead
+            raise FuseOSError(EXDEV)
+        
         f = self._get_file_by_path(old)
-        f.rename(new)
-        del self.path_files[path]
-        newpath = self._construct_path(f)
-        self.path_files[path] = f
+        name = os.path.basename(new)
+        self._api_file(f).rename(name)
+        
+        with self.lock:
+            siblings = self.children[f.parent_id]
+            siblings.pop(os.path.basename(old), None)
+            replaced = siblings.get(name)
+            if replaced is not None and replaced is not f:
+                self._remove_from_files(replaced)
+                self.cache.discard_file(replaced.id)
+            f.name = name
+            siblings[name] = f
+            self._forget_path(old)
+            self._forget_path(new)
          
     def rmdir(self, path):
         f = self._get_file_by_path(path)
-        id = f.id
-        f.delete()
-        del self.files[id]
-        del self.path_files[path]
+        self._api_file(f).delete()
+        with self.lock:
+            self._remove_from_files(f)
+            self._forget_path(path)
     
     def statfs(self, path):
         return dict(f_bsize=512, f_blocks=4096, f_bavail=2048)
     
-    def write(self, path, data, offset, fh):
-        f = self.temporary_files[path]
-        f.seek(offset)
-        f.write(data)
+    def write(self, path, data, offset, fi):
+        self.handles[fi.fh].buffer.write(data, offset)
         return len(data)
 
 
@@ -186,11 +555,124 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='FUSE wrapper for put.io')
     parser.add_argument('mount_point')
     parser.add_argument('oauth_token')
+    parser.add_argument('--block-size', type=int, default=1024,
+        help='size of cached blocks in KiB')
+    parser.add_argument('--cache-size', type=int, default=64,
+        help='memory used for caching blocks in MiB')
+    parser.add_argument('--disk-cache-size', type=int, default=0,
+        help='disk space used for blocks evicted from memory in MiB')
+    parser.add_argument('--cache-dir',
+        help='directory for the disk cache, defaults to system temp dir')
+    parser.add_argument('--prefetch-workers', type=int, default=4,
+        help='number of threads fetching blocks ahead of reads')
+    parser.add_argument('--max-readahead', type=int, default=16,
+        help='maximum number of blocks to prefetch for sequential reads')
+    parser.add_argument('--head-prefetch', type=int, default=1024,
+        help='KiB fetched from the start of a matching file when it is opened')
+    parser.add_argument('--tail-prefetch', type=int, default=1024,
+        help='KiB fetched from the end of a matching file when it is opened')
+    parser.add_argument('--prefetch-types', default='video/,audio/,.mkv',
+        help='comma separated extensions (.mkv) and content types (video/) '
+            'to prefetch on open')
+    parser.add_argument('--max-connections', type=int, default=8,
+        help='maximum number of parallel connections to a single host')
+    parser.add_argument('--timeout', type=float, default=30,
+        help='timeout of HTTP requests in seconds')
+    parser.add_argument('--io-slots', type=int, default=0,
+        help='requests run at a time in priority order, '
+            'defaults to --max-connections')
+    parser.add_argument('--rate-limit', type=int, default=0,
+        help='KiB per second transferred by all requests, 0 is unlimited')
+    parser.add_argument('--class-rate-limit', action='append', default=[],
+        metavar='CLASS=KIB', help='KiB per second of one of %s, '
+            'may be repeated' % ', '.join(CLASS_NAMES))
+    parser.add_argument('--api-url', default=API_URL,
+        help='base URL of the put.io API')
+    parser.add_argument('--parallel', type=int, default=1,
+        help='number of ranges a block is split into and downloaded in parallel')
+    parser.add_argument('--min-part-size', type=int, default=256,
+        help='minimum size of a range downloaded in parallel in KiB')
+    parser.add_argument('--url-ttl', type=int, default=600,
+        help='seconds a resolved download URL is reused, 0 disables')
+    parser.add_argument('--deadline', type=float, default=20,
+        help='seconds after which a download attempt is given up, 0 disables')
+    parser.add_argument('--retries', type=int, default=2,
+        help='number of times a failed download is retried')
+    parser.add_argument('--hedge-percentile', type=float, default=0,
+        help='start a second download when the first is slower than this '
+            'percentile of past downloads, 0 disables')
+    parser.add_argument('--upload-url', default=UPLOAD_URL,
+        help='URL files are uploaded to')
+    parser.add_argument('--upload-workers', type=int, default=2,
+        help='number of files uploaded at the same time')
+    parser.add_argument('--upload-retries', type=int, default=3,
+        help='number of times a failed upload is retried')
+    parser.add_argument('--write-memory', type=int, default=64,
+        help='memory shared by files being written in MiB')
+    parser.add_argument('--spill-size', type=int, default=1024,
+        help='size in KiB above which a written file is kept on disk')
+    parser.add_argument('--sync-interval', type=float, default=30,
+        help='seconds between polls for changes on put.io, 0 disables')
+    parser.add_argument('--max-sync-interval', type=float, default=600,
+        help='longest interval between polls while nothing changes')
+    parser.add_argument('--preload', action='store_true',
+        help='fetch the whole file tree at mount instead of listing directories on demand')
+    parser.add_argument('--dir-ttl', type=float, default=60,
+        help='seconds after which a listed directory is fetched again')
+    parser.add_argument('--snapshot',
+        help='file to keep the file tree in between mounts')
+    parser.add_argument('--snapshot-interval', type=float, default=300,
+        help='seconds between saves of the snapshot')
+    parser.add_argument('--attr-timeout', type=float, default=60,
+        help='seconds the kernel caches file attributes')
+    parser.add_argument('--entry-timeout', type=float, default=60,
+        help='seconds the kernel caches name lookups')
+    parser.add_argument('--negative-timeout', type=float, default=10,
+        help='seconds the kernel caches lookups of missing names')
+    parser.add_argument('--log-level', default='WARNING',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--log-ops', type=float, default=0,
+        help='fraction of filesystem operations to log, 1 logs all')
     args = parser.parse_args()
     
-    logger = logging.getLogger('putio2')
-    logging.basicConfig(level=logging.DEBUG)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(threadName)s %(name)s %(levelname)s %(message)s'))
+    logging.root.addHandler(QueueHandler(handler))
+    logging.root.setLevel(args.log_level)
+    if args.log_ops:
+        logging.getLogger('putiofs.ops').setLevel(logging.DEBUG)
     
     client = putio2.Client(args.oauth_token)
     
-    fuse = FUSE(PutioFS(), args.mount_point, foreground=True)
+    cache = BlockCache(args.block_size * 1024, args.cache_size * 1024 * 1024,
+        args.disk_cache_size * 1024 * 1024, args.cache_dir)
+    
+    pool = ConnectionPool(args.max_connections, args.timeout)
+    class_rates = {}
+    for limit in args.class_rate_limit:
+        name, rate = limit.split('=')
+        class_rates[CLASS_NAMES.index(name)] = int(rate) * 1024
+    pool.scheduler = IOScheduler(args.io_slots or args.max_connections,
+        args.rate_limit * 1024, class_rates)
+    downloader = Downloader(pool, args.oauth_token, args.api_url,
+        args.parallel, args.min_part_size * 1024, args.url_ttl, args.deadline,
+        args.retries, hedge_percentile=args.hedge_percentile)
+    uploader = UploadManager(pool, args.oauth_token, args.upload_url,
+        args.upload_workers, args.upload_retries)
+    
+    syncer = None
+    if args.sync_interval:
+        syncer = Syncer(pool, args.oauth_token, args.api_url,
+            args.sync_interval, args.max_sync_interval)
+    
+    fs = PutioFS(downloader, uploader, syncer, cache, args.prefetch_workers,
+        args.max_readahead, args.preload, args.dir_ttl,
+        args.snapshot and Snapshot(args.snapshot), args.snapshot_interval,
+        args.write_memory * 1024 * 1024, args.spill_size * 1024,
+        OpenPrefetch(args.head_prefetch * 1024, args.tail_prefetch * 1024,
+            filter(None, args.prefetch_types.split(','))))
+    fs.log_sample = args.log_ops
+    fuse = FUSE(fs, args.mount_point, raw_fi=True, foreground=True,
+        attr_timeout=args.attr_timeout, entry_timeout=args.entry_timeout,
+        negative_timeout=args.negative_timeout)
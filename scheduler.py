@@ -0,0 +1,197 @@
+from collections import deque, OrderedDict
+from threading import Condition
+from time import time
+
+from stats import Histogram
+
+# priority classes, most urgent first
+READ, PREFETCH, UPLOAD, SYNC = range(4)
+CLASS_NAMES = ('read', 'prefetch', 'upload', 'sync')
+
+
+class TokenBucket(object):
+    """Rate limit of rate bytes per second, 0 is unlimited.
+
+    Requests are admitted while the bucket is not empty and their bytes are
+    taken afterwards, so a large request puts the bucket in debt and
+    delays the next ones instead of being split."""
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.updated = time()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        '''Returns seconds until a request may be admitted'''
+        if not self.rate:
+            return 0
+        self._refill(now)
+        return 0 if self.tokens > 0 else -self.tokens / self.rate + 0.001
+
+    def take(self, nbytes, now):
+        if self.rate:
+            self._refill(now)
+            self.tokens -= nbytes
+
+
+class Ticket(object):
+    """A request waiting for, or holding, a slot of the scheduler"""
+
+    __slots__ = ('priority', 'owner', 'key', 'queued', 'granted')
+
+    def __init__(self, priority, owner, key, queued):
+        self.priority = priority
+        self.owner = owner
+        self.key = key
+        self.queued = queued
+        self.granted = False
+
+
+class ClassStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.active = 0
+        self.wait = Histogram()
+
+    def summary(self, queued):
+        return dict(requests=self.requests, bytes=self.bytes, queued=queued,
+            active=self.active, wait=self.wait.summary())
+
+
+class IOScheduler(object):
+    """Orders network requests by priority class.
+
+    At most slots requests run at a time. A free slot goes to the most
+    urgent class that has a request waiting and is within its rate limit
+    and the global one. Inside a class, owners (open files, uploads) take
+    turns so one busy stream cannot starve the others.
+
+    Requests made for a key (a block) run in the most urgent class wanted
+    for it, so a read waiting for a block being prefetched moves the
+    prefetch up instead of waiting behind the other prefetches."""
+
+    def __init__(self, slots, rate=0, class_rates=None):
+        self.slots = slots
+        self.active = 0
+        self.bucket = TokenBucket(rate)
+        class_rates = class_rates or {}
+        self.buckets = [TokenBucket(class_rates.get(p, 0))
+            for p in range(len(CLASS_NAMES))]
+        # waiting tickets of each class {owner: deque([Ticket])}, in turn order
+        self.queues = [OrderedDict() for p in range(len(CLASS_NAMES))]
+        self.queued = [0] * len(CLASS_NAMES)
+        self.classes = [ClassStats() for p in range(len(CLASS_NAMES))]
+        self.wanted = {} # priorities of the callers waiting for a key {key: [priority]}
+        self.cond = Condition()
+
+    def want(self, key, priority):
+        '''Registers a caller waiting at priority for the requests of key,
+           until unwant. Queued requests of key move up to priority.'''
+        with self.cond:
+            wanted = self.wanted.setdefault(key, [])
+            wanted.append(priority)
+            if priority > min(wanted):
+                return
+            moving = [t for queue in self.queues[priority + 1:]
+                for tickets in queue.values() for t in tickets if t.key == key]
+            for ticket in moving:
+                self._move(ticket, priority)
+            if moving:
+                self._dispatch()
+
+    def unwant(self, key, priority):
+        with self.cond:
+            wanted = self.wanted[key]
+            wanted.remove(priority)
+            if not wanted:
+                del self.wanted[key]
+
+    def acquire(self, priority, owner=None, key=None):
+        '''Waits for a slot, returns the Ticket to release'''
+        ticket = Ticket(priority, owner, key, time())
+        with self.cond:
+            if key in self.wanted:
+                ticket.priority = min(priority, min(self.wanted[key]))
+            self.queues[ticket.priority].setdefault(owner, deque()).append(ticket)
+            self.queued[ticket.priority] += 1
+            while True:
+                delay = self._dispatch()
+                if ticket.granted:
+                    break
+                self.cond.wait(delay)
+            stats = self.classes[ticket.priority]
+            stats.wait.add(time() - ticket.queued)
+            stats.requests += 1
+            stats.active += 1
+        return ticket
+
+    def release(self, ticket, nbytes):
+        '''Frees the slot of ticket, nbytes is the size of its transfer'''
+        now = time()
+        with self.cond:
+            self.active -= 1
+            self.classes[ticket.priority].active -= 1
+            self.classes[ticket.priority].bytes += nbytes
+            self.bucket.take(nbytes, now)
+            self.buckets[ticket.priority].take(nbytes, now)
+            self._dispatch()
+            self.cond.notify_all()
+
+    def _dispatch(self):
+        '''Grants free slots to waiting tickets. Returns seconds until a
+           rate limited class may go on, None if none is waiting on a limit.'''
+        now = time()
+        wait = None
+        granted = False
+        while self.active < self.slots:
+            ticket = None
+            for priority, queue in enumerate(self.queues):
+                if not queue:
+                    continue
+                delay = max(self.bucket.delay(now), self.buckets[priority].delay(now))
+                if delay:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                ticket = self._next(priority)
+                break
+            if ticket is None:
+                break
+            ticket.granted = granted = True
+            self.active += 1
+        if granted:
+            self.cond.notify_all()
+        return wait
+
+    def _next(self, priority):
+        '''Takes the next ticket of a class, round robin between owners'''
+        queue = self.queues[priority]
+        owner, tickets = queue.popitem(last=False)
+        ticket = tickets.popleft()
+        if tickets:
+            queue[owner] = tickets # to the end of the turn
+        self.queued[priority] -= 1
+        return ticket
+
+    def _move(self, ticket, priority):
+        '''Moves a waiting ticket to the queue of another class'''
+        queue = self.queues[ticket.priority]
+        tickets = queue[ticket.owner]
+        tickets.remove(ticket)
+        if not tickets:
+            del queue[ticket.owner]
+        self.queued[ticket.priority] -= 1
+        ticket.priority = priority
+        self.queues[priority].setdefault(ticket.owner, deque()).append(ticket)
+        self.queued[priority] += 1
+
+    def stats(self):
+        with self.cond:
+            return dict((name, self.classes[p].summary(self.queued[p]))
+                for p, name in enumerate(CLASS_NAMES))
@@ -0,0 +1,62 @@
+import sys
+from threading import Event, Lock
+
+
+class Call(object):
+    """A call in flight, its result is set before done"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None # sys.exc_info() if the call raised
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time.
+
+    A caller asking for a key whose call is in flight waits for it and gets
+    the same result, or the same exception, instead of making the call
+    again."""
+
+    def __init__(self):
+        self.calls = {} # {key: Call}
+        self.lock = Lock()
+
+        self.made = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        '''Returns fn(*args), or the result of the call in flight for key'''
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                self.made += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return dict(calls=self.made, shared=self.shared,
+                in_flight=len(self.calls))
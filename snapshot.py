@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import logging
+
+from metadata import Entry
+
+logger = logging.getLogger(__name__)
+
+# persisted fields of Entry, in the order of its constructor arguments
+FIELDS = ('id', 'parent_id', 'name', 'mode', 'size', 'mtime')
+
+
+class Snapshot(object):
+    """File tree saved to an SQLite database between mounts"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        '''Returns ([Entry], [listed directory id]) or None if there is no
+           usable snapshot.'''
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            db = sqlite3.connect(self.path)
+            db.text_factory = str # names are byte strings like the mount paths
+            try:
+                rows = db.execute('SELECT %s FROM files' % ', '.join(FIELDS))
+                entries = [Entry(*row) for row in rows]
+                listed = [row[0] for row in db.execute('SELECT id FROM listed')]
+            finally:
+                db.close()
+        except sqlite3.Error, e:
+            logger.warning('cannot load snapshot %s: %s', self.path, e)
+            return None
+        return entries, listed
+
+    def save(self, entries, listed):
+        '''Replaces the snapshot with entries and listed directory ids'''
+        temp = self.path + '.tmp'
+        if os.path.exists(temp):
+            os.remove(temp)
+
+        db = sqlite3.connect(temp)
+        db.text_factory = str
+        try:
+            db.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, '
+                'parent_id INTEGER, name TEXT, mode INTEGER, size INTEGER, '
+                'mtime REAL)')
+            db.execute('CREATE TABLE listed (id INTEGER PRIMARY KEY)')
+            db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                (tuple(getattr(e, field) for field in FIELDS) for e in entries))
+            db.executemany('INSERT INTO listed VALUES (?)', ((id,) for id in listed))
+            db.commit()
+        finally:
+            db.close()
+        os.rename(temp, self.path)
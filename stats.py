@@ -0,0 +1,99 @@
+from threading import Lock
+from time import time
+
+
+class Histogram(object):
+    """Latency histogram with power of two microsecond buckets"""
+
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.total = 0.0
+
+    def add(self, seconds):
+        i = int(seconds * 1000000).bit_length()
+        if i >= self.buckets:
+            i = self.buckets - 1
+        self.counts[i] += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        '''Returns upper bound of the bucket holding percentile p in seconds'''
+        n = sum(self.counts)
+        if not n:
+            return 0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= n * p / 100.0:
+                return (1 << i) / 1000000.0
+        return (1 << (self.buckets - 1)) / 1000000.0
+
+    def summary(self):
+        n = sum(self.counts)
+        return dict(
+            mean=self.total / n if n else 0,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99),
+            # {upper bound in microseconds: count}
+            buckets=dict((1 << i, c) for i, c in enumerate(self.counts) if c))
+
+
+class OpStats(object):
+    __slots__ = ('count', 'errors', 'bytes', 'latency')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = Histogram()
+
+    def summary(self):
+        return dict(count=self.count, errors=self.errors, bytes=self.bytes,
+            latency=self.latency.summary())
+
+
+class Metrics(object):
+    """Count, errors, bytes and latency of named operations"""
+
+    def __init__(self):
+        self.ops = {} # {name: OpStats}
+        self.lock = Lock()
+
+    def record(self, name, seconds, nbytes=0, error=False):
+        op = self.ops.get(name)
+        if op is None:
+            with self.lock:
+                op = self.ops.setdefault(name, OpStats())
+        with self.lock:
+            op.count += 1
+            op.errors += error
+            op.bytes += nbytes
+            op.latency.add(seconds)
+
+    def summary(self):
+        with self.lock:
+            return dict((name, op.summary()) for name, op in self.ops.items())
+
+
+class MetricsMixIn(object):
+    """Records every FUSE operation to self.metrics"""
+
+    def __call__(self, op, *args):
+        start = time()
+        try:
+            ret = super(MetricsMixIn, self).__call__(op, *args)
+        except:
+            self.metrics.record(op, time() - start, 0, True)
+            raise
+
+        if op == 'read':
+            nbytes = len(ret)
+        elif op == 'readinto' or op == 'write':
+            nbytes = ret
+        else:
+            nbytes = 0
+        self.metrics.record(op, time() - start, nbytes)
+        return ret
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Runs readdir, getattr, read and create on PutioFS from many threads.
+
+put.io is replaced by a local HTTP server for downloads and uploads and by
+an in-memory tree for the metadata API, which also changes files while the
+workers run. Operations are called the way FUSE calls them, without
+mounting. Exits with status 1 if any operation raised an unexpected error
+or read wrong data."""
+
+import re
+import json
+import random
+import argparse
+import traceback
+from sys import exit
+from time import sleep, time
+from threading import Event, Lock, Thread
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import putiofs
+from cache import BlockCache
+from httppool import ConnectionPool
+from download import Downloader
+from upload import UploadManager
+from scheduler import IOScheduler
+from metadata import DIRECTORY
+
+FILE_SIZE = 256 * 1024
+PATTERN = ''.join(chr(i % 251) for i in xrange(FILE_SIZE + 251))
+
+
+def content(id, start, end):
+    '''Returns bytes of file id, the same whatever its size is'''
+    return PATTERN[id % 251 + start:id % 251 + end]
+
+
+class Tree(object):
+    """Files of the stand-in account as {id: dict}"""
+
+    def __init__(self):
+        self.files = {}
+        self.next_id = 1
+        self.dir_id = None # of the directory made at start
+        self.lock = Lock()
+        self.uploads = 0
+
+    def add(self, name, parent_id, content_type, size=0):
+        '''Adds a file, named f<id> if name is None'''
+        with self.lock:
+            id = self.next_id
+            self.next_id += 1
+            self.files[id] = dict(id=id, name=name or 'f%d' % id,
+                parent_id=parent_id, content_type=content_type, size=size)
+            return dict(self.files[id])
+
+    def get(self, id):
+        with self.lock:
+            return dict(self.files[id]) if id in self.files else None
+
+    def children(self, parent_id):
+        with self.lock:
+            return [dict(f) for f in self.files.values()
+                if parent_id == -1 or f['parent_id'] == parent_id]
+
+    def rename(self, id, name):
+        with self.lock:
+            self.files[id]['name'] = name
+
+    def delete(self, id):
+        with self.lock:
+            self.files.pop(id, None)
+
+    def resize(self, id, size):
+        with self.lock:
+            if id in self.files:
+                self.files[id]['size'] = size
+
+tree = Tree()
+
+
+class File(object):
+    """Stand-in of putio2.File working on tree"""
+
+    def __init__(self, d):
+        self.__dict__.update(d)
+
+    def rename(self, name):
+        tree.rename(self.id, name)
+
+    def delete(self):
+        tree.delete(self.id)
+
+    @classmethod
+    def list(cls, parent_id, as_dict=False):
+        return dict((f['id'], cls(f)) for f in tree.children(parent_id))
+
+    @classmethod
+    def create_folder(cls, name='New Folder', parent_id=0):
+        return cls(tree.add(name, parent_id, DIRECTORY))
+
+
+class Client(object):
+    File = File
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves downloads through a redirect to storage, and uploads"""
+
+    protocol_version = 'HTTP/1.1'
+    delay = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body='', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        m = re.match(r'/v2/files/(\d+)/download', self.path)
+        if m:
+            return self._send(302, headers=[('Location', '/storage/' + m.group(1))])
+
+        m = re.match(r'/storage/(\d+)$', self.path)
+        file = m and tree.get(int(m.group(1)))
+        if not file:
+            return self._send(404)
+        sleep(self.delay)
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)',
+            self.headers['Range']).groups())
+        if start >= file['size']:
+            return self._send(416)
+        end = min(end + 1, file['size'])
+        self._send(206, content(file['id'], start, end))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        parent_id = int(re.search(r'name="parent_id"\r\n\r\n(\d+)', body).group(1))
+        name = re.search(r'filename="([^"]*)"', body).group(1)
+        data = body.split('\r\n\r\n', 2)[2].rsplit('\r\n--', 1)[0]
+        file = tree.add(name, parent_id, 'application/octet-stream', len(data))
+        with tree.lock:
+            tree.uploads += 1
+        self._send(200, json.dumps(dict(status='OK', file=file)))
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FileInfo(object):
+    """What FUSE passes as fi"""
+    fh = 0
+    keep_cache = 0
+    direct_io = 0
+
+
+def worker(fs, n, args, counts, errors):
+    r = random.Random(args.seed + n)
+    for i in xrange(args.ops):
+        op = r.choice(['readdir', 'getattr', 'read', 'create'])
+        dir = r.choice(['/', '/dir'])
+        try:
+            if op == 'readdir':
+                fs('readdir', dir, 0)
+            elif op == 'getattr':
+                fs('getattr', '%s/f%d' % (dir.rstrip('/'), r.randint(1, args.files)))
+            elif op == 'read':
+                names = [e[0] for e in fs('readdir', dir, 0)[2:]
+                    if re.match(r'f\d+$', e[0])]
+                path = '%s/%s' % (dir.rstrip('/'), r.choice(names))
+                fi = FileInfo()
+                fs('open', path, fi)
+                try:
+                    offset = r.randint(0, FILE_SIZE)
+                    data = fs('read', path, r.randint(1, 65536), offset, fi)
+                finally:
+                    fs('release', path, fi)
+                id = int(re.search(r'f(\d+)$', path).group(1))
+                if data != content(id, offset, offset + len(data)):
+                    errors.append('wrong data read from %s at %d' % (path, offset))
+            else:
+                path = '%s/new-%d-%d' % (dir.rstrip('/'), n, i)
+                fi = FileInfo()
+                fs('create', path, 0644, fi)
+                fs('write', path, 'x' * r.randint(1, 4096), 0, fi)
+                fs('release', path, fi)
+        except OSError:
+            # files are removed under the workers, ENOENT and EIO are expected
+            op += ' failed'
+        except Exception:
+            errors.append(traceback.format_exc())
+        counts[op] = counts.get(op, 0) + 1
+
+
+def change_files(args, stopped):
+    '''Resizes, removes and adds files on the server while the workers run'''
+    r = random.Random(args.seed)
+    while not stopped.is_set():
+        ids = [f['id'] for f in tree.children(-1) if re.match(r'f\d+$', f['name'])]
+        action = r.choice(['resize', 'remove', 'add'])
+        if action == 'resize':
+            tree.resize(r.choice(ids), r.randint(1, FILE_SIZE))
+        elif action == 'remove' and len(ids) > args.files // 2:
+            tree.delete(r.choice(ids))
+        elif action == 'add':
+            tree.add(None, r.choice([0, tree.dir_id]), 'text/plain', FILE_SIZE)
+        sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=16,
+        help='threads calling operations at once')
+    parser.add_argument('--ops', type=int, default=200,
+        help='operations made by each thread')
+    parser.add_argument('--files', type=int, default=50,
+        help='files in the account at start')
+    parser.add_argument('--delay', type=float, default=0.005,
+        help='seconds the server takes for each download')
+    parser.add_argument('--dir-ttl', type=float, default=0.05,
+        help='seconds after which a listed directory is fetched again')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tree.dir_id = tree.add('dir', 0, DIRECTORY)['id']
+    for i in range(args.files):
+        tree.add(None, i % 2 and tree.dir_id or 0, 'text/plain', FILE_SIZE)
+
+    Handler.delay = args.delay
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = Thread(target=server.serve_forever, name='server')
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    putiofs.client = Client()
+    pool = ConnectionPool()
+    pool.scheduler = IOScheduler(pool.max_per_host)
+    fs = putiofs.PutioFS(Downloader(pool, 'token', url + '/v2'),
+        UploadManager(pool, 'token', url + '/upload'), None,
+        BlockCache(64 * 1024, 1024 * 1024, 4 * 1024 * 1024), dir_ttl=args.dir_ttl)
+    fs('init', '/')
+
+    counts = [{} for n in range(args.threads)]
+    errors = []
+    stopped = Event()
+    changer = Thread(target=change_files, args=(args, stopped))
+    changer.start()
+    threads = [Thread(target=worker, args=(fs, n, args, counts[n], errors))
+        for n in range(args.threads)]
+    start = time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time() - start
+    stopped.set()
+    changer.join()
+
+    created = sum(c.get('create', 0) for c in counts)
+    fs('destroy', '/')
+    server.shutdown()
+
+    total = {}
+    for c in counts:
+        for op, n in c.items():
+            total[op] = total.get(op, 0) + n
+    for op in sorted(total):
+        print '%-16s %d' % (op, total[op])
+    print '%d operations in %.2fs, %.0f/s' % (sum(total.values()), elapsed,
+        sum(total.values()) / elapsed)
+    print 'uploaded %d of %d created files' % (tree.uploads, created)
+    for error in errors[:5]:
+        print error
+    print '%d errors' % len(errors)
+    if errors or tree.uploads != created:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
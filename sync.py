@@ -0,0 +1,82 @@
+import json
+import logging
+from threading import Event, Thread
+from urllib import urlencode
+
+from download import API_URL
+from httppool import HTTPError
+from scheduler import SYNC
+
+logger = logging.getLogger(__name__)
+
+
+class Syncer(object):
+    """Polls the put.io event list for files changed on the server.
+
+    The directories of the files in new events are passed to apply, which
+    returns True if it found any changes. The poll interval doubles up to
+    max_interval while nothing changes and drops back when something does."""
+
+    def __init__(self, pool, oauth_token, api_url=API_URL, interval=30,
+            max_interval=600):
+        self.pool = pool
+        self.oauth_token = oauth_token
+        self.api_url = api_url.rstrip('/')
+        self.interval = interval
+        self.max_interval = max_interval
+        self.apply = None # called as apply([directory id]), returns True on changes
+        self.last_event = None # id of the newest event seen
+        self.stopped = Event()
+
+    def start(self):
+        t = Thread(target=self._loop, name='sync')
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _get(self, path):
+        url = '%s%s?%s' % (self.api_url, path,
+            urlencode(dict(oauth_token=self.oauth_token)))
+        resp = self.pool.request('GET', url, priority=SYNC)
+        if resp.status != 200:
+            raise HTTPError(resp.status, resp.reason, self.api_url + path)
+        return json.loads(resp.body)
+
+    def poll(self):
+        '''Returns ids of directories holding files of events since the
+           last poll. The first poll only records the newest event.'''
+        events = self._get('/events/list')['events']
+        if not events:
+            return set()
+
+        last_event, self.last_event = self.last_event, max(e['id'] for e in events)
+        if last_event is None:
+            return set()
+
+        dirs = set()
+        for event in events:
+            file_id = event.get('file_id')
+            if event['id'] <= last_event or file_id is None:
+                continue
+            try:
+                dirs.add(self._get('/files/%d' % file_id)['file']['parent_id'])
+            except HTTPError, e:
+                # file may be deleted since
+                logger.info('cannot get file %s of event: %s', file_id, e)
+        return dirs
+
+    def _loop(self):
+        interval = self.interval
+        while not self.stopped.wait(interval):
+            try:
+                changed = self.apply(self.poll())
+            except Exception:
+                logger.exception('sync failed')
+                changed = False
+
+            if changed:
+                interval = self.interval
+            else:
+                interval = min(interval * 2, self.max_interval)
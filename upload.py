@@ -0,0 +1,174 @@
+import json
+import logging
+from Queue import Queue
+from threading import Lock, Thread
+from time import sleep
+from urllib import urlencode
+from uuid import uuid4
+
+from httppool import HTTPError
+from scheduler import UPLOAD
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL = 'https://upload.put.io/v2/files/upload'
+
+
+class MultipartBody(object):
+    """multipart/form-data body streaming a file object of size bytes"""
+
+    def __init__(self, fields, name, filename, file, size):
+        self.boundary = uuid4().hex
+        head = []
+        for key, value in fields:
+            head.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' %
+                (self.boundary, key, value))
+        head.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n' % (self.boundary, name, filename))
+        self.head = ''.join(head)
+        self.tail = '\r\n--%s--\r\n' % self.boundary
+        self.file = file
+        self.length = len(self.head) + size + len(self.tail)
+        self.seek(0)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def seek(self, offset):
+        '''Rewinds the body, offset must be 0'''
+        self.file.seek(0)
+        self.parts = [self.head, self.file, self.tail]
+
+    def read(self, size):
+        while self.parts:
+            part = self.parts[0]
+            if isinstance(part, str):
+                self.parts.pop(0)
+                if part:
+                    return part
+            else:
+                data = part.read(size)
+                if data:
+                    return data
+                self.parts.pop(0)
+        return ''
+
+    def close(self):
+        self.file.close()
+
+
+class Upload(object):
+    """A file written to the mount, waiting to be uploaded"""
+
+    def __init__(self, path, buffer, parent_id, name):
+        self.path = path # in the mount
+        self.buffer = buffer # WriteBuffer
+        self.parent_id = parent_id
+        self.name = name
+
+
+class UploadManager(object):
+    """Uploads finished files in background worker threads.
+
+    Files are streamed from their write buffer and retried with exponential
+    backoff. The buffer is closed when the upload is finished or given up."""
+
+    def __init__(self, pool, oauth_token, upload_url=UPLOAD_URL,
+            workers=2, retries=3, backoff=1):
+        self.pool = pool
+        self.oauth_token = oauth_token
+        self.done = None # called as done(upload, file) when an upload is confirmed
+        self.upload_url = upload_url
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = Queue()
+        self.pending = {} # {path: Upload}
+        self.threads = []
+        self.lock = Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            t = Thread(target=self._work, name='upload-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        '''Finishes the queued uploads, then stops the workers'''
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        del self.threads[:]
+
+        with self.lock:
+            for upload in self.pending.values():
+                logger.error('upload of %s not finished, dropped', upload.path)
+
+    def submit(self, path, buffer, parent_id, name):
+        upload = Upload(path, buffer, parent_id, name)
+        with self.lock:
+            self.pending[path] = upload
+        self.queue.put(upload)
+
+    def get(self, path):
+        '''Returns the pending Upload at path or None'''
+        with self.lock:
+            return self.pending.get(path)
+
+    def in_directory(self, parent_id):
+        with self.lock:
+            return [u for u in self.pending.values() if u.parent_id == parent_id]
+
+    def _work(self):
+        while True:
+            upload = self.queue.get()
+            if upload is None:
+                return
+
+            try:
+                file = self._upload_with_retries(upload)
+                if file is not None:
+                    self.done(upload, file)
+            except Exception:
+                logger.exception('cannot add uploaded file %s', upload.path)
+            finally:
+                with self.lock:
+                    if self.pending.get(upload.path) is upload:
+                        del self.pending[upload.path]
+                upload.buffer.close()
+
+    def _upload_with_retries(self, upload):
+        for attempt in range(self.retries + 1):
+            try:
+                return self._upload(upload)
+            except Exception, e:
+                if attempt == self.retries:
+                    logger.error('giving up upload of %s: %s', upload.path, e)
+                    return None
+                delay = self.backoff * 2 ** attempt
+                logger.warning('upload of %s failed, retrying in %ds: %s',
+                    upload.path, delay, e)
+                sleep(delay)
+
+    def _upload(self, upload):
+        '''Returns the uploaded file as a dict of the API response'''
+        body = MultipartBody([('parent_id', upload.parent_id)], 'file',
+            upload.name, upload.buffer.reader(), upload.buffer.size)
+        try:
+            url = '%s?%s' % (self.upload_url,
+                urlencode(dict(oauth_token=self.oauth_token)))
+            headers = {
+                'Content-Type': body.content_type,
+                'Content-Length': str(body.length),
+            }
+            resp = self.pool.request('POST', url, headers, body,
+                priority=UPLOAD, owner=upload.path)
+        finally:
+            body.close()
+
+        if resp.status != 200:
+            raise HTTPError(resp.status, resp.reason, self.upload_url)
+        return json.loads(resp.body)['file']
@@ -0,0 +1,105 @@
+import os
+from cStringIO import StringIO
+from stat import S_IFREG
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+
+
+class MemoryBudget(object):
+    """Memory shared by the write buffers of all files being written"""
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.spills = 0
+        self.lock = Lock()
+
+    def reserve(self, n):
+        '''Takes n bytes from the budget, returns False if they don't fit'''
+        with self.lock:
+            if self.used + n > self.size:
+                return False
+            self.used += n
+            return True
+
+    def release(self, n):
+        with self.lock:
+            self.used -= n
+
+    def stats(self):
+        with self.lock:
+            return dict(size=self.size, used=self.used, spills=self.spills)
+
+
+class WriteBuffer(object):
+    """Contents of a file written to the mount.
+
+    Data is kept in a bytearray taken from budget until the file grows over
+    spill_size or the budget runs out, then it is moved to a temporary file.
+    Appends extend the bytearray in memory and skip the seek on disk."""
+
+    def __init__(self, budget, spill_size):
+        self.budget = budget
+        self.spill_size = spill_size
+        self.data = bytearray()
+        self.file = None # NamedTemporaryFile after spilling
+        self.position = 0 # of file
+        self.size = 0
+        self.ctime = self.mtime = time()
+        self.lock = Lock()
+
+    def write(self, data, offset):
+        end = offset + len(data)
+        with self.lock:
+            if self.file is None:
+                grow = max(end - len(self.data), 0)
+                if end <= self.spill_size and self.budget.reserve(grow):
+                    if offset > len(self.data):
+                        self.data.extend('\0' * (offset - len(self.data)))
+                    self.data[offset:end] = data
+                else:
+                    self._spill()
+
+            if self.file is not None:
+                if offset != self.position:
+                    self.file.seek(offset)
+                self.file.write(data)
+                self.position = end
+
+            self.size = max(self.size, end)
+            self.mtime = time()
+
+    def _spill(self):
+        self.file = NamedTemporaryFile(delete=False)
+        self.file.write(self.data)
+        self.position = len(self.data)
+        self.budget.release(len(self.data))
+        with self.budget.lock:
+            self.budget.spills += 1
+        self.data = None
+
+    def stat(self):
+        return dict(st_mode=(S_IFREG | 0600), st_nlink=1, st_size=self.size,
+            st_uid=os.getuid(), st_gid=os.getgid(),
+            st_ctime=self.ctime, st_mtime=self.mtime, st_atime=self.mtime)
+
+    def reader(self):
+        '''Returns a file object reading the contents from the start'''
+        with self.lock:
+            if self.file is None:
+                return StringIO(self.data)
+            self.file.flush()
+            return open(self.file.name, 'rb')
+
+    def close(self):
+        '''Frees the memory or the temporary file'''
+        with self.lock:
+            if self.file is None:
+                self.budget.release(len(self.data))
+                self.data = bytearray()
+            else:
+                self.file.close()
+                os.remove(self.file.name)
+                self.file = None
+                self.data = bytearray()